@@ -8,6 +8,10 @@ USE DATABASE BOOTCAMP_RALLY;
 CREATE SCHEMA IF NOT EXISTS CORE;   -- teams, cars
 CREATE SCHEMA IF NOT EXISTS OPS;    -- races, results, transactions
 
+-- The app takes team ids from this sequence and always inserts them explicitly;
+-- the block at the end moves it past any ids already in CORE.TEAMS.
+CREATE SEQUENCE IF NOT EXISTS CORE.TEAMS_SEQ;
+
 -- Teams table: budgets tracked here
 CREATE TABLE IF NOT EXISTS CORE.TEAMS (
     TEAM_ID INTEGER AUTOINCREMENT PRIMARY KEY,
@@ -30,6 +34,10 @@ CREATE TABLE IF NOT EXISTS CORE.CARS (
     CREATED_AT TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP
 );
 
+-- The app fetches race ids from this sequence before inserting, and always inserts
+-- them explicitly; the block at the end moves it past any ids already in OPS.RACES.
+CREATE SEQUENCE IF NOT EXISTS OPS.RACES_SEQ;
+
 -- Races table: one row per race event
 CREATE TABLE IF NOT EXISTS OPS.RACES (
     RACE_ID INTEGER AUTOINCREMENT PRIMARY KEY,
@@ -63,3 +71,30 @@ CREATE TABLE IF NOT EXISTS OPS.TRANSACTIONS (
     REASON STRING,
     CREATED_AT TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP
 );
+
+-- Tables created before the sequences existed already hold AUTOINCREMENT ids from 1,
+-- and PRIMARY KEY is not enforced, so recreate a sequence above its table's highest
+-- id whenever it would hand out one already taken.
+EXECUTE IMMEDIATE $$
+DECLARE
+    max_id INTEGER;
+    next_id INTEGER;
+    stmt STRING;
+BEGIN
+    SELECT COALESCE(MAX(TEAM_ID), 0) INTO :max_id FROM CORE.TEAMS;
+    SELECT NEXT_VALUE INTO :next_id FROM INFORMATION_SCHEMA.SEQUENCES
+        WHERE SEQUENCE_SCHEMA = 'CORE' AND SEQUENCE_NAME = 'TEAMS_SEQ';
+    IF (next_id <= max_id) THEN
+        stmt := 'CREATE OR REPLACE SEQUENCE CORE.TEAMS_SEQ START = ' || (max_id + 1);
+        EXECUTE IMMEDIATE :stmt;
+    END IF;
+
+    SELECT COALESCE(MAX(RACE_ID), 0) INTO :max_id FROM OPS.RACES;
+    SELECT NEXT_VALUE INTO :next_id FROM INFORMATION_SCHEMA.SEQUENCES
+        WHERE SEQUENCE_SCHEMA = 'OPS' AND SEQUENCE_NAME = 'RACES_SEQ';
+    IF (next_id <= max_id) THEN
+        stmt := 'CREATE OR REPLACE SEQUENCE OPS.RACES_SEQ START = ' || (max_id + 1);
+        EXECUTE IMMEDIATE :stmt;
+    END IF;
+END;
+$$;
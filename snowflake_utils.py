@@ -1,8 +1,18 @@
+import functools
 import os
 import pathlib
-from typing import Any, Optional, Sequence, Tuple, Union
+import queue
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import sqlparse
 
 try:
     import streamlit as st  
@@ -17,8 +27,16 @@ except Exception as exc:
     ) from exc
 
 
-def _get_snowflake_config() -> dict:
-    """Fetch Snowflake connection params from Streamlit secrets or environment variables."""
+# bootstrap.sql creates and uses this database, so every session is pinned to it.
+_DATABASE = "BOOTCAMP_RALLY"
+
+
+@functools.lru_cache(maxsize=1)
+def _get_snowflake_config() -> Mapping[str, Any]:
+    """Fetch Snowflake connection params from Streamlit secrets or environment variables.
+
+    The result is cached for the life of the process and returned read-only.
+    """
     cfg: dict
     if st is not None and hasattr(st, "secrets") and "snowflake" in st.secrets:
         cfg = dict(st.secrets["snowflake"])  
@@ -29,12 +47,11 @@ def _get_snowflake_config() -> dict:
             "password": os.getenv("SNOWFLAKE_PASSWORD", ""),
             "warehouse": os.getenv("SNOWFLAKE_WAREHOUSE", ""),
             "role": os.getenv("SNOWFLAKE_ROLE", ""),
-            "database": os.getenv("SNOWFLAKE_DATABASE", "BOOTCAMP_RALLY"),
         }
     missing = [k for k, v in cfg.items() if k in ("account", "user", "password") and not v]
     if missing:
         raise ValueError(f"Missing Snowflake credentials: {', '.join(missing)}")
-    return cfg
+    return MappingProxyType(cfg)
 
 
 def get_connection() -> "snowflake.connector.SnowflakeConnection":
@@ -45,24 +62,98 @@ def get_connection() -> "snowflake.connector.SnowflakeConnection":
         password=cfg.get("password"),
         warehouse=cfg.get("warehouse") or None,
         role=cfg.get("role") or None,
-        database=cfg.get("database") or None,
+        database=_DATABASE,
+        # qmark binds on the server, which lets executemany send parameter arrays
+        # instead of rewriting each row into the SQL text.
+        paramstyle="qmark",
+        # Pooled and cached connections can sit idle for hours; keep their session token fresh.
+        client_session_keep_alive=True,
     )
     return conn
 
 
+# Insert statements kept as constants so every call sends byte-identical SQL.
+_INSERT_CAR_SQL = """
+INSERT INTO CORE.CARS (
+    TEAM_ID, CAR_NAME, TOP_SPEED_KMH, ACCELERATION_0_100_S,
+    HANDLING, RELIABILITY, WEIGHT_KG
+) VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+_INSERT_TRANSACTION_SQL = """
+INSERT INTO OPS.TRANSACTIONS (TEAM_ID, RACE_ID, AMOUNT, CURRENCY, REASON)
+VALUES (?, ?, ?, ?, ?)
+"""
+_INSERT_RACE_RESULT_PREFIX = """
+INSERT INTO OPS.RACE_RESULTS (RACE_ID, CAR_ID, TEAM_ID, FINISH_TIME_MINUTES, STATUS, POSITION)
+VALUES """
+_INSERT_RACE_RESULT_SQL = _INSERT_RACE_RESULT_PREFIX + "(?, ?, ?, ?, ?, ?)\n"
+
+# Batches larger than this are loaded via PUT + COPY INTO instead of bound INSERTs.
+BULK_STAGE_THRESHOLD = 500
+
+# Idle connections kept warm for reuse; extra connections beyond this are closed on return.
+_POOL_SIZE = int(os.getenv("SNOWFLAKE_POOL_SIZE", "4"))
+_POOL: "queue.Queue[snowflake.connector.SnowflakeConnection]" = queue.Queue(maxsize=_POOL_SIZE)
+
+
+@contextmanager
+def borrow_conn() -> Iterator["snowflake.connector.SnowflakeConnection"]:
+    """Borrow a connection from the pool, opening a new one lazily if none is idle.
+
+    A connection whose borrower raised is closed instead of being returned to the pool.
+    """
+    try:
+        conn = _POOL.get_nowait()
+    except queue.Empty:
+        conn = get_connection()
+    if conn.is_closed():
+        conn = get_connection()
+    try:
+        yield conn
+    except BaseException:
+        # The session may be dead while still reporting itself open; never pool it again.
+        conn.close()
+        raise
+    try:
+        _POOL.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+# Error numbers Snowflake returns once a session's token has expired or been dropped.
+_SESSION_GONE_ERRNOS = frozenset({390111, 390112, 390114})
+
+
+def is_session_lost(exc: BaseException) -> bool:
+    """Return True if exc means the connection must be re-established before retrying."""
+    return (
+        isinstance(exc, snowflake.connector.errors.DatabaseError)
+        and getattr(exc, "errno", None) in _SESSION_GONE_ERRNOS
+    )
+
+
 def execute(
-    conn: "snowflake.connector.SnowflakeConnection",
+    conn: Optional["snowflake.connector.SnowflakeConnection"],
     sql: str,
-    params: Optional[Union[Sequence[Any], dict]] = None,
+    params: Optional[Sequence[Any]] = None,
     fetch: str = "none",
-) -> Union[None, Tuple, list, pd.DataFrame]:
-    """Execute a SQL statement with optional parameters.
+) -> Union[None, Tuple, list, pd.DataFrame, pa.Table, Iterator[pd.DataFrame]]:
+    """Execute a SQL statement with optional positional (qmark) parameters.
+
+    If conn is None, a connection is borrowed from the pool for the call.
 
     - fetch='none' returns None
     - fetch='one' returns a single tuple or None
     - fetch='all' returns list of tuples
-    - fetch='df' returns a pandas DataFrame
+    - fetch='df' returns a pandas DataFrame (Arrow result path)
+    - fetch='arrow' returns a pyarrow Table (empty if there are no rows)
+    - fetch='df_batches' returns an iterator of pandas DataFrame chunks
     """
+    if fetch == "df_batches":
+        return _iter_pandas_batches(conn, sql, params)
+    if conn is None:
+        with borrow_conn() as pooled:
+            return execute(pooled, sql, params, fetch)
     with conn.cursor() as cur:
         cur.execute(sql, params) if params else cur.execute(sql)
         if fetch == "none":
@@ -74,25 +165,137 @@ def execute(
             rows = cur.fetchall()
             return rows
         if fetch == "df":
-            try:
-                return cur.fetch_pandas_all()
-            except Exception:
-                columns = [c[0] for c in cur.description]
-                rows = cur.fetchall()
-                return pd.DataFrame(rows, columns=columns)
-        raise ValueError("Invalid fetch mode. Use 'none', 'one', 'all', or 'df'.")
+            return cur.fetch_pandas_all()
+        if fetch == "arrow":
+            return cur.fetch_arrow_all(force_return_table=True)
+        raise ValueError("Invalid fetch mode. Use 'none', 'one', 'all', 'df', 'arrow', or 'df_batches'.")
 
 
-def init_database(conn: "snowflake.connector.SnowflakeConnection") -> None:
-    """Create database, schemas, and tables if they don't already exist."""
+def _iter_pandas_batches(
+    conn: Optional["snowflake.connector.SnowflakeConnection"],
+    sql: str,
+    params: Optional[Sequence[Any]] = None,
+) -> Iterator[pd.DataFrame]:
+    """Yield result chunks as DataFrames, keeping the cursor open until exhausted."""
+    if conn is None:
+        with borrow_conn() as pooled:
+            yield from _iter_pandas_batches(pooled, sql, params)
+        return
+    with conn.cursor() as cur:
+        cur.execute(sql, params) if params else cur.execute(sql)
+        yield from cur.fetch_pandas_batches()
+
+
+def execute_many(
+    conn: Optional["snowflake.connector.SnowflakeConnection"],
+    sql: str,
+    seq_of_params: Sequence[Sequence[Any]],
+) -> None:
+    """Execute one qmark statement for every parameter row via array binding.
+
+    If conn is None, a connection is borrowed from the pool for the call.
+    """
+    if not seq_of_params:
+        return
+    if conn is None:
+        with borrow_conn() as pooled:
+            return execute_many(pooled, sql, seq_of_params)
+    with conn.cursor() as cur:
+        cur.executemany(sql, list(seq_of_params))
+
+
+def _stage_load_sql(
+    local_path: pathlib.PurePath,
+    fq_table: str,
+    columns: Sequence[str],
+) -> Tuple[str, str]:
+    """Build the PUT and COPY INTO statements that load one staged Parquet file."""
+    schema, table = fq_table.split(".")
+    stage = f"@{schema}.%{table}"
+    # PUT wants the plain path after file://, not a percent-encoded URI.
+    put_sql = f"PUT 'file://{local_path.as_posix()}' {stage} AUTO_COMPRESS=FALSE OVERWRITE=TRUE"
+    copy_sql = f"""
+        COPY INTO {fq_table} ({", ".join(columns)})
+        FROM (SELECT {", ".join(f'$1:"{c}"' for c in columns)} FROM {stage})
+        FILES = ('{local_path.name}')
+        FILE_FORMAT = (TYPE = PARQUET)
+        PURGE = TRUE
+        """
+    return put_sql, copy_sql
+
+
+def bulk_insert_via_stage(
+    conn: "snowflake.connector.SnowflakeConnection",
+    df: pd.DataFrame,
+    fq_table: str,
+) -> None:
+    """Load a DataFrame into SCHEMA.TABLE by staging it as Parquet and running COPY INTO.
+
+    DataFrame column names must match the target table's columns. Columns not present
+    in the DataFrame (ids, timestamps) get their table defaults.
+    """
+    table = fq_table.split(".")[1]
+    file_name = f"{table.lower()}_{uuid.uuid4().hex}.parquet"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        local_path = pathlib.Path(tmp_dir, file_name)
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), local_path)
+        put_sql, copy_sql = _stage_load_sql(local_path, fq_table, list(df.columns))
+        with conn.cursor() as cur:
+            cur.execute(put_sql)
+            cur.execute(copy_sql)
+
+
+@functools.lru_cache(maxsize=1)
+def _bootstrap_statements() -> Tuple[str, ...]:
+    """Read bootstrap.sql once and return its statements with comments stripped."""
     bootstrap_path = pathlib.Path(__file__).with_name("bootstrap.sql")
     if not bootstrap_path.exists():
         raise FileNotFoundError(f"Bootstrap SQL not found at {bootstrap_path}")
     ddl = bootstrap_path.read_text(encoding="utf-8")
-    statements = [s.strip() for s in ddl.split(";") if s.strip()]
+    # sqlparse handles ';' inside literals; comments are dropped so they don't count as statements.
+    return tuple(
+        stripped.rstrip(";")
+        for stmt in sqlparse.split(ddl)
+        if (stripped := sqlparse.format(stmt, strip_comments=True).strip())
+    )
+
+
+def init_database(conn: "snowflake.connector.SnowflakeConnection") -> None:
+    """Create database, schemas, and tables if they don't already exist."""
+    statements = _bootstrap_statements()
+    script = ";\n".join(statements) + ";"
     with conn.cursor() as cur:
-        for stmt in statements:
-            cur.execute(stmt)
+        cur.execute(script, num_statements=len(statements))
+
+
+# Sequence values are fetched this many at a time, so most id lookups need no query.
+_ID_BLOCK_SIZE = 20
+_ID_BLOCKS: Dict[str, List[int]] = {}
+_ID_LOCK = threading.Lock()
+
+
+def _next_ids(
+    conn: "snowflake.connector.SnowflakeConnection",
+    sequence: str,
+    n: int,
+) -> List[int]:
+    """Take n unused ids from SCHEMA.SEQUENCE, refilling the local block when it runs short.
+
+    Ids left in the block when the process exits are never used, which leaves gaps.
+    """
+    with _ID_LOCK:
+        block = _ID_BLOCKS.setdefault(sequence, [])
+        if len(block) < n:
+            count = max(n - len(block), _ID_BLOCK_SIZE)
+            rows = execute(
+                conn,
+                f"SELECT {sequence}.NEXTVAL FROM TABLE(GENERATOR(ROWCOUNT => {int(count)}))",
+                fetch="all",
+            )
+            block.extend(sorted(int(r[0]) for r in rows))
+        ids = block[:n]
+        del block[:n]
+    return ids
 
 
 def upsert_team(
@@ -100,15 +303,33 @@ def upsert_team(
     team_name: str,
     members: str,
     starting_budget: float,
-) -> None:
-    execute(
+) -> int:
+    return upsert_teams_many(conn, [(team_name, members, starting_budget)])[0]
+
+
+def upsert_teams_many(
+    conn: "snowflake.connector.SnowflakeConnection",
+    rows: Sequence[Tuple[str, str, float]],
+) -> List[int]:
+    """Insert many teams and return their ids, in row order.
+
+    Ids come from CORE.TEAMS_SEQ via _next_ids, so callers can reference the new teams
+    without re-reading CORE.TEAMS.
+
+    Each row is (team_name, members, starting_budget).
+    """
+    if not rows:
+        return []
+    team_ids = _next_ids(conn, "CORE.TEAMS_SEQ", len(rows))
+    execute_many(
         conn,
         """
-        INSERT INTO CORE.TEAMS (TEAM_NAME, MEMBERS, BUDGET)
-        VALUES (%s, %s, %s)
+        INSERT INTO CORE.TEAMS (TEAM_ID, TEAM_NAME, MEMBERS, BUDGET)
+        VALUES (?, ?, ?, ?)
         """,
-        (team_name, members, starting_budget),
+        [(team_id, *row) for team_id, row in zip(team_ids, rows)],
     )
+    return team_ids
 
 
 def insert_car(
@@ -123,21 +344,31 @@ def insert_car(
 ) -> None:
     execute(
         conn,
-        """
-        INSERT INTO CORE.CARS (
-            TEAM_ID, CAR_NAME, TOP_SPEED_KMH, ACCELERATION_0_100_S,
-            HANDLING, RELIABILITY, WEIGHT_KG
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """,
+        _INSERT_CAR_SQL,
         (team_id, car_name, top_speed_kmh, accel_0_100_s, handling, reliability, weight_kg),
     )
 
 
+def insert_cars_many(
+    conn: "snowflake.connector.SnowflakeConnection",
+    rows: Sequence[Tuple[int, str, float, float, int, float, Optional[int]]],
+) -> None:
+    """Insert many cars in one round trip.
+
+    Each row is (team_id, car_name, top_speed_kmh, accel_0_100_s, handling, reliability, weight_kg).
+    """
+    execute_many(conn, _INSERT_CAR_SQL, rows)
+
+
 def get_teams_df(conn: "snowflake.connector.SnowflakeConnection") -> pd.DataFrame:
     return execute(conn, "SELECT TEAM_ID, TEAM_NAME, MEMBERS, BUDGET FROM CORE.TEAMS ORDER BY TEAM_NAME", fetch="df")  # type: ignore
 
 
-def get_cars_with_teams_df(conn: "snowflake.connector.SnowflakeConnection") -> pd.DataFrame:
+def get_cars_for_race(conn: "snowflake.connector.SnowflakeConnection") -> pa.Table:
+    """All cars with their team, as a pyarrow Table.
+
+    Unordered: the race ranks cars by simulated time, so a server-side sort is wasted.
+    """
     return execute(
         conn,
         """
@@ -145,32 +376,47 @@ def get_cars_with_teams_df(conn: "snowflake.connector.SnowflakeConnection") -> p
             c.TOP_SPEED_KMH, c.ACCELERATION_0_100_S, c.HANDLING, c.RELIABILITY, c.WEIGHT_KG
         FROM CORE.CARS c
         JOIN CORE.TEAMS t ON t.TEAM_ID = c.TEAM_ID
-        ORDER BY t.TEAM_NAME, c.CAR_NAME
         """,
-        fetch="df",
+        fetch="arrow",
     )
 
 
-def record_transaction(
+def record_transactions_bulk(
     conn: "snowflake.connector.SnowflakeConnection",
-    team_id: int,
-    race_id: Optional[int],
-    amount: float,
-    reason: str,
-    currency: str = "USD",
+    rows: Sequence[Tuple[int, Optional[int], float, str, str]],
 ) -> None:
+    """Insert many transactions and apply their budget deltas in two statements.
+
+    The ledger rows are inserted first, then deltas are summed per team in Python and
+    applied with a single MERGE. The two statements are not atomic: if the MERGE fails,
+    the OPS.TRANSACTIONS rows exist without the matching budget change, but budgets are
+    never changed without a ledger entry.
+
+    Each row is (team_id, race_id, amount, currency, reason).
+    """
+    if not rows:
+        return
+    if len(rows) > BULK_STAGE_THRESHOLD:
+        df = pd.DataFrame(list(rows), columns=["TEAM_ID", "RACE_ID", "AMOUNT", "CURRENCY", "REASON"])
+        df["RACE_ID"] = df["RACE_ID"].astype("Int64")
+        bulk_insert_via_stage(conn, df, "OPS.TRANSACTIONS")
+    else:
+        execute_many(conn, _INSERT_TRANSACTION_SQL, rows)
+
+    deltas: dict = {}
+    for team_id, _, amount, _, _ in rows:
+        deltas[team_id] = deltas.get(team_id, 0.0) + amount
+    values_sql = ", ".join(["(?, ?)"] * len(deltas))
+    params = [v for team_id, amount in deltas.items() for v in (team_id, amount)]
     execute(
         conn,
-        """
-        INSERT INTO OPS.TRANSACTIONS (TEAM_ID, RACE_ID, AMOUNT, CURRENCY, REASON)
-        VALUES (%s, %s, %s, %s, %s)
+        f"""
+        MERGE INTO CORE.TEAMS t
+        USING (SELECT $1 AS TEAM_ID, $2 AS AMT FROM VALUES {values_sql}) s
+        ON t.TEAM_ID = s.TEAM_ID
+        WHEN MATCHED THEN UPDATE SET BUDGET = COALESCE(t.BUDGET, 0) + s.AMT
         """,
-        (team_id, race_id, amount, currency, reason),
-    )
-    execute(
-        conn,
-        "UPDATE CORE.TEAMS SET BUDGET = COALESCE(BUDGET, 0) + %s WHERE TEAM_ID = %s",
-        (amount, team_id),
+        params,
     )
 
 
@@ -183,32 +429,64 @@ def create_race(
     prize_second: float,
     prize_third: float,
 ) -> int:
+    race_id = _next_ids(conn, "OPS.RACES_SEQ", 1)[0]
     execute(
         conn,
         """
-        INSERT INTO OPS.RACES (RACE_NAME, DISTANCE_KM, ENTRY_FEE, PRIZE_FIRST, PRIZE_SECOND, PRIZE_THIRD)
-        VALUES (%s, %s, %s, %s, %s, %s)
+        INSERT INTO OPS.RACES (RACE_ID, RACE_NAME, DISTANCE_KM, ENTRY_FEE, PRIZE_FIRST, PRIZE_SECOND, PRIZE_THIRD)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
         """,
-        (race_name, distance_km, entry_fee, prize_first, prize_second, prize_third),
+        (race_id, race_name, distance_km, entry_fee, prize_first, prize_second, prize_third),
     )
-    row = execute(conn, "SELECT MAX(RACE_ID) FROM OPS.RACES", fetch="one")
-    return int(row[0]) if row and row[0] is not None else 0
+    return race_id
 
 
-def insert_race_result(
+def insert_race_results_many(
     conn: "snowflake.connector.SnowflakeConnection",
-    race_id: int,
-    car_id: int,
-    team_id: int,
-    finish_time_minutes: Optional[float],
-    status: str,
-    position: Optional[int],
+    rows: Sequence[Tuple[int, int, int, Optional[float], str, Optional[int]]],
 ) -> None:
-    execute(
-        conn,
-        """
-        INSERT INTO OPS.RACE_RESULTS (RACE_ID, CAR_ID, TEAM_ID, FINISH_TIME_MINUTES, STATUS, POSITION)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        """,
-        (race_id, car_id, team_id, finish_time_minutes, status, position),
-    )
+    """Insert many race results in one round trip, staging large batches via COPY INTO.
+
+    Each row is (race_id, car_id, team_id, finish_time_minutes, status, position).
+    """
+    if not rows:
+        return
+    if len(rows) > BULK_STAGE_THRESHOLD:
+        df = pd.DataFrame(
+            list(rows),
+            columns=["RACE_ID", "CAR_ID", "TEAM_ID", "FINISH_TIME_MINUTES", "STATUS", "POSITION"],
+        )
+        df["POSITION"] = df["POSITION"].astype("Int64")
+        bulk_insert_via_stage(conn, df, "OPS.RACE_RESULTS")
+        return
+    execute_many(conn, _INSERT_RACE_RESULT_SQL, rows)
+
+
+def insert_race_results_async(
+    conn: "snowflake.connector.SnowflakeConnection",
+    rows: Sequence[Tuple[int, int, int, Optional[float], str, Optional[int]]],
+) -> Optional[str]:
+    """Submit race results without waiting for them and return the query id to join on.
+
+    executemany has no async form, so the rows go in one multi-row INSERT sent with
+    execute_async. Batches above BULK_STAGE_THRESHOLD are staged and loaded synchronously
+    instead, and None is returned.
+
+    Each row is (race_id, car_id, team_id, finish_time_minutes, status, position).
+    """
+    if not rows:
+        return None
+    if len(rows) > BULK_STAGE_THRESHOLD:
+        insert_race_results_many(conn, rows)
+        return None
+    sql = _INSERT_RACE_RESULT_PREFIX + ", ".join(["(?, ?, ?, ?, ?, ?)"] * len(rows))
+    with conn.cursor() as cur:
+        cur.execute_async(sql, [v for row in rows for v in row])
+        return cur.sfqid
+
+
+def wait_for_query(conn: "snowflake.connector.SnowflakeConnection", sfqid: str) -> None:
+    """Block until an async query finishes, raising its error if it failed."""
+    with conn.cursor() as cur:
+        cur.get_results_from_sfqid(sfqid)
+        cur.fetchall()
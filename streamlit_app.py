@@ -1,23 +1,43 @@
-import random
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import streamlit as st
 
 from snowflake_utils import (
     create_race,
-    get_cars_with_teams_df,
+    get_cars_for_race,
     get_connection,
     get_teams_df,
     init_database,
     insert_car,
-    record_transaction,
+    insert_cars_many,
+    insert_race_results_async,
+    is_session_lost,
+    record_transactions_bulk,
     upsert_team,
-    insert_race_result,
+    upsert_teams_many,
+    wait_for_query,
 )
 
 
+# Track segments per preset: (length_fraction, speed_factor, handling_factor)
+_SEG_TEMPLATES: Dict[str, np.ndarray] = {
+    "Mixed (default)": np.array([[0.4, 0.95, 0.98], [0.3, 0.85, 0.92], [0.3, 0.75, 0.9]]),
+    "Fast asphalt": np.array([[1.0, 1.05, 1.0]]),
+    "Gravel twisty": np.array([[0.6, 0.8, 0.9], [0.4, 0.7, 0.85]]),
+}
+# Combined speed_factor * handling_factor per segment, precomputed once per preset
+_SEG_SPEED_FACTORS: Dict[str, np.ndarray] = {
+    preset: tmpl[:, 1] * tmpl[:, 2] for preset, tmpl in _SEG_TEMPLATES.items()
+}
+
+# Shared generator for the race simulation; SFC64 since runs don't need to be reproducible
+_RNG = np.random.Generator(np.random.SFC64())
+
+
 # -----------------------------
 # Page setup
 # -----------------------------
@@ -52,30 +72,73 @@ if conn_error:
     )
     st.stop()
 
+
+def run_db(fn, *args, retry: bool = True):
+    """Call fn(conn, *args), rebuilding the cached connection if its session was lost.
+
+    Reads are retried once on the new connection. Writes pass retry=False and re-raise,
+    since the failed statement may already have been applied.
+    """
+    global conn
+    try:
+        return fn(conn, *args)
+    except Exception as e:
+        if not is_session_lost(e):
+            raise
+        try:
+            conn.close()
+        except Exception:
+            pass
+        get_conn_cached.clear()
+        conn = get_conn_cached()
+        if not retry:
+            raise
+        return fn(conn, *args)
+
+
+# Leading underscore keeps Streamlit from hashing the connection object.
+@st.cache_data(ttl=30, show_spinner=False)
+def get_teams_df_cached(_conn) -> pd.DataFrame:
+    return get_teams_df(_conn)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_cars_for_race_cached(_conn) -> pa.Table:
+    return get_cars_for_race(_conn)
+
+
 # -----------------------------
 # Sidebar: Teams & Budgets
 # -----------------------------
 st.sidebar.header("Teams & Budgets")
 
 if st.sidebar.button("🔄 Refresh teams"):
+    get_teams_df_cached.clear()
     st.sidebar.success("Refreshed")
 
-teams_df = get_teams_df(conn)
+teams_df = run_db(get_teams_df_cached)
 st.sidebar.dataframe(teams_df, use_container_width=True, hide_index=True)
 
 # Seed demo data (optional)
 with st.sidebar.expander("Seed demo data"):
     if st.button("Add sample teams and cars"):
         try:
-            upsert_team(conn, "Falcon Motorsport", "Alice,Bob", 10000)
-            upsert_team(conn, "Thunder Racing", "Carol,Dan", 8000)
-           
-            teams = get_teams_df(conn)
-            team_map = {r["TEAM_NAME"]: int(r["TEAM_ID"]) for _, r in teams.iterrows()}
-           
-            insert_car(conn, team_map["Falcon Motorsport"], "Falcon X1", 220.0, 5.2, 85, 0.92, 1200)
-            insert_car(conn, team_map["Falcon Motorsport"], "Falcon X2", 210.0, 5.6, 80, 0.88, 1250)
-            insert_car(conn, team_map["Thunder Racing"], "Storm ZR", 230.0, 4.9, 78, 0.85, 1180)
+            falcon_id, thunder_id = run_db(
+                upsert_teams_many,
+                [("Falcon Motorsport", "Alice,Bob", 10000), ("Thunder Racing", "Carol,Dan", 8000)],
+                retry=False,
+            )
+            run_db(
+                insert_cars_many,
+                [
+                    (falcon_id, "Falcon X1", 220.0, 5.2, 85, 0.92, 1200),
+                    (falcon_id, "Falcon X2", 210.0, 5.6, 80, 0.88, 1250),
+                    (thunder_id, "Storm ZR", 230.0, 4.9, 78, 0.85, 1180),
+                ],
+                retry=False,
+            )
+            get_teams_df_cached.clear()
+            get_cars_for_race_cached.clear()
             st.success("Sample data added.")
         except Exception as e:
             st.error(f"Failed to seed data: {e}")
@@ -97,7 +160,8 @@ if st.button("➕ Add Team"):
         st.warning("Team name is required.")
     else:
         try:
-            upsert_team(conn, team_name.strip(), team_members.strip(), float(starting_budget))
+            run_db(upsert_team, team_name.strip(), team_members.strip(), float(starting_budget), retry=False)
+            get_teams_df_cached.clear()
             st.success(f"Team '{team_name}' added.")
         except Exception as e:
             st.error(f"Failed to add team: {e}")
@@ -107,8 +171,8 @@ if st.button("➕ Add Team"):
 # -----------------------------
 st.subheader("🚗 Add Car")
 
-teams_df = get_teams_df(conn)
-team_options = [f"{row.TEAM_ID} - {row.TEAM_NAME}" for _, row in teams_df.iterrows()]
+teams_df = run_db(get_teams_df_cached)
+team_options = teams_df["TEAM_ID"].astype(str).str.cat(teams_df["TEAM_NAME"], sep=" - ").tolist()
 selected_team = st.selectbox("Assign to team", options=team_options if len(team_options) else ["No teams yet"], index=0 if len(team_options) else None)
 
 col1, col2, col3 = st.columns(3)
@@ -130,7 +194,8 @@ if st.button("➕ Add Car"):
     else:
         try:
             team_id = int(selected_team.split(" - ")[0])
-            insert_car(conn, team_id, car_name.strip(), float(top_speed), float(accel), int(handling), float(reliability), int(weight))
+            run_db(insert_car, team_id, car_name.strip(), float(top_speed), float(accel), int(handling), float(reliability), int(weight), retry=False)
+            get_cars_for_race_cached.clear()
             st.success(f"Car '{car_name}' added to team {selected_team}.")
         except Exception as e:
             st.error(f"Failed to add car: {e}")
@@ -157,131 +222,145 @@ with col5:
 with col6:
     track_preset = st.selectbox(
         "Track preset",
-        ["Mixed (default)", "Fast asphalt", "Gravel twisty"],
+        list(_SEG_TEMPLATES),
     )
 
 
-def simulate_time_minutes(
-    top_speed_kmh: float,
-    accel_0_100_s: float,
-    handling: int,
-    reliability: float,
+def simulate_times_vec(
+    top_speed: np.ndarray,
+    accel: np.ndarray,
+    handling: np.ndarray,
+    reliability: np.ndarray,
     distance_km: float,
     preset: str,
-) -> (float, bool):
-    # Define track segments (length_km, speed_factor, handling_factor)
-    if preset == "Fast asphalt":
-        segments = [(distance_km, 1.05, 1.0)]
-    elif preset == "Gravel twisty":
-        segments = [(distance_km * 0.6, 0.8, 0.9), (distance_km * 0.4, 0.7, 0.85)]
-    else: 
-        segments = [
-            (distance_km * 0.4, 0.95, 0.98),
-            (distance_km * 0.3, 0.85, 0.92),
-            (distance_km * 0.3, 0.75, 0.9),
-        ]
-
-    base_speed = float(top_speed_kmh)
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Simulate finish times (minutes) and DNF flags for all cars at once."""
+    tmpl = _SEG_TEMPLATES[preset]
+    seg_len = tmpl[:, 0] * distance_km
+    seg_factor = _SEG_SPEED_FACTORS[preset]
+
+    n_cars = len(top_speed)
+    n_segments = len(tmpl)
+
+    base_speed = np.asarray(top_speed, dtype=float)
     # Handling scale from 0.5 (50) to 1.0 (100)
-    handling_scale = 0.5 + (max(50, min(100, handling)) - 50) / 100.0
+    handling_scale = 0.5 + (np.clip(np.asarray(handling, dtype=float), 50, 100) - 50) / 100.0
     # Acceleration influences initial pace; faster accel yields slight boost
-    accel_scale = max(0.9, min(1.05, 1.0 + (6.0 - accel_0_100_s) * 0.02))
+    accel_scale = np.clip(1.0 + (6.0 - np.asarray(accel, dtype=float)) * 0.02, 0.9, 1.05)
+    car_speed = base_speed * handling_scale * accel_scale
 
-    minutes = 0.0
-    for length_km, speed_factor, handling_factor in segments:
-        random_variation = random.uniform(0.92, 1.08)
-        segment_speed = base_speed * handling_scale * accel_scale * speed_factor * handling_factor * random_variation
-        segment_speed = max(60.0, segment_speed)
-        hours = length_km / segment_speed
-        minutes += hours * 60.0
+    seg_speed = _RNG.uniform(0.92, 1.08, (n_cars, n_segments))
+    seg_speed *= seg_factor
+    seg_speed *= car_speed[:, None]
+    np.maximum(seg_speed, 60.0, out=seg_speed)
+    minutes = (seg_len / seg_speed).sum(axis=1) * 60.0
 
-    finish_probability = max(0.05, min(0.99, reliability))
-    dnf = random.random() > finish_probability
+    finish_probability = np.clip(np.asarray(reliability, dtype=float), 0.05, 0.99)
+    dnf = _RNG.random(n_cars) > finish_probability
 
-    if not dnf:
-        minutes *= random.uniform(0.98, 1.05)
+    minutes[~dnf] *= _RNG.uniform(0.98, 1.05, int((~dnf).sum()))
 
     return minutes, dnf
 
 
 if st.button("🏁 Start race!"):
-    cars_df = get_cars_with_teams_df(conn)
-    if cars_df.empty:
+    cars_tbl = run_db(get_cars_for_race_cached)
+    if cars_tbl.num_rows == 0:
         st.warning("No cars available. Please add cars first.")
         st.stop()
 
-    race_id = create_race(conn, race_name or "Rally", float(distance_km), float(entry_fee), float(prize_first), float(prize_second), float(prize_third))
-
-    participating_team_ids = sorted(list({int(tid) for tid in cars_df["TEAM_ID"].tolist()}))
-    for team_id in participating_team_ids:
-        record_transaction(conn, team_id, race_id, -float(entry_fee), f"Entry fee for {race_name}")
-
-    results: List[Dict] = []
-    for _, row in cars_df.iterrows():
-        mins, dnf = simulate_time_minutes(
-            float(row["TOP_SPEED_KMH"]),
-            float(row["ACCELERATION_0_100_S"]),
-            int(row["HANDLING"]),
-            float(row["RELIABILITY"]),
-            float(distance_km),
-            track_preset,
-        )
-        results.append(
-            {
-                "CAR_ID": int(row["CAR_ID"]),
-                "CAR_NAME": row["CAR_NAME"],
-                "TEAM_ID": int(row["TEAM_ID"]),
-                "TEAM_NAME": row["TEAM_NAME"],
-                "TIME_MIN": mins if not dnf else None,
-                "DNF": dnf,
-            }
-        )
-
-    if all(r["DNF"] for r in results):
-        best_idx = min(range(len(results)), key=lambda i: results[i]["TIME_MIN"] or float("inf"))
-        results[best_idx]["DNF"] = False
-        if results[best_idx]["TIME_MIN"] is None:
-            results[best_idx]["TIME_MIN"] = random.uniform(distance_km/3, distance_km/2)  # fallback
+    race_id = run_db(create_race, race_name or "Rally", float(distance_km), float(entry_fee), float(prize_first), float(prize_second), float(prize_third), retry=False)
+
+    car_ids = cars_tbl.column("CAR_ID").to_pylist()
+    car_names = cars_tbl.column("CAR_NAME").to_pylist()
+    team_ids = cars_tbl.column("TEAM_ID").to_pylist()
+    team_names = cars_tbl.column("TEAM_NAME").to_pylist()
+
+    participating_team_ids = sorted(set(team_ids))
+    tx_rows = [
+        (team_id, race_id, -float(entry_fee), "USD", f"Entry fee for {race_name}")
+        for team_id in participating_team_ids
+    ]
+
+    sim_minutes, sim_dnf = simulate_times_vec(
+        cars_tbl.column("TOP_SPEED_KMH").to_numpy(zero_copy_only=False),
+        cars_tbl.column("ACCELERATION_0_100_S").to_numpy(zero_copy_only=False),
+        cars_tbl.column("HANDLING").to_numpy(zero_copy_only=False),
+        cars_tbl.column("RELIABILITY").to_numpy(zero_copy_only=False),
+        float(distance_km),
+        track_preset,
+    )
 
+    n_cars = len(car_ids)
+    dnf = sim_dnf.copy()
+    time_min = np.where(dnf, np.nan, sim_minutes)
+    position = np.zeros(n_cars, dtype=np.int32)
 
-    finishers = [r for r in results if not r["DNF"]]
-    finishers.sort(key=lambda r: r["TIME_MIN"]) 
-    for pos, r in enumerate(finishers, start=1):
-        r["POSITION"] = pos
-    for r in results:
-        if r.get("POSITION") is None:
-            r["POSITION"] = None
+    if dnf.all():
+        # Nobody finished: the car with the best simulated pace is classified as the winner.
+        best_idx = int(np.argmin(sim_minutes))
+        dnf[best_idx] = False
+        time_min[best_idx] = sim_minutes[best_idx]
 
+    finish_count = int((~dnf).sum())
+    order = np.argsort(np.where(dnf, np.inf, time_min), kind="stable")
+    finisher_idx = order[:finish_count]
+    position[finisher_idx] = np.arange(1, finish_count + 1)
 
     prizes = [float(prize_first), float(prize_second), float(prize_third)]
-    for idx in range(min(3, len(finishers))):
-        team_id = finishers[idx]["TEAM_ID"]
+    for idx in range(min(3, finish_count)):
+        team_id = team_ids[finisher_idx[idx]]
         amount = prizes[idx]
         if amount > 0:
-            record_transaction(conn, team_id, race_id, amount, f"Prize for position {idx+1} in {race_name}")
-
-    for r in results:
-        insert_race_result(
-            conn,
-            race_id,
-            int(r["CAR_ID"]),
-            int(r["TEAM_ID"]),
-            float(r["TIME_MIN"]) if r["TIME_MIN"] is not None else None,
-            "FINISHED" if not r["DNF"] else "DNF",
-            int(r["POSITION"]) if r["POSITION"] is not None else None,
+            tx_rows.append((team_id, race_id, amount, "USD", f"Prize for position {idx+1} in {race_name}"))
+
+    # Object arrays hold native Python ints/floats with None for DNFs, ready for binding.
+    time_obj = time_min.astype(object)
+    time_obj[dnf] = None
+    pos_obj = position.astype(object)
+    pos_obj[position == 0] = None
+    status = np.where(dnf, "DNF", "FINISHED")
+    result_rows = list(
+        zip(
+            [race_id] * n_cars,
+            car_ids,
+            team_ids,
+            time_obj.tolist(),
+            status.tolist(),
+            pos_obj.tolist(),
         )
-
-    results_df = pd.DataFrame(results)
-    results_df_display = results_df.copy()
-    if "TIME_MIN" in results_df_display.columns:
-        results_df_display["TIME_MIN"] = results_df_display["TIME_MIN"].map(lambda x: round(x, 2) if isinstance(x, (float, int)) else None)
-
-    st.success(f"Race '{race_name}' completed! Race ID: {race_id}")
-    st.dataframe(
-        results_df_display.sort_values(by=["DNF", "POSITION"], ascending=[True, True]),
-        use_container_width=True,
-        hide_index=True,
     )
+    results_df = pd.DataFrame(
+        {
+            "CAR_ID": car_ids,
+            "CAR_NAME": car_names,
+            "TEAM_ID": team_ids,
+            "TEAM_NAME": team_names,
+            "TIME_MIN": time_min.round(2),
+            "DNF": dnf,
+            "POSITION": pd.Series(position, dtype="Int64").mask(position == 0),
+        }
+    )
+
+    status_box = st.empty()
+    # Results don't affect budgets, so the server inserts them while transactions are
+    # recorded and budgets re-read; the join below runs even if those steps fail.
+    results_qid = run_db(insert_race_results_async, result_rows, retry=False)
+    try:
+        run_db(record_transactions_bulk, tx_rows, retry=False)
+        get_teams_df_cached.clear()
+
+        st.dataframe(
+            results_df.sort_values(by=["DNF", "POSITION", "TEAM_NAME", "CAR_NAME"]),
+            use_container_width=True,
+            hide_index=True,
+        )
+        # Refills the cache, so the next rerun doesn't query budgets again.
+        budgets_df = run_db(get_teams_df_cached)
+    finally:
+        if results_qid is not None:
+            run_db(wait_for_query, results_qid, retry=False)
+    status_box.success(f"Race '{race_name}' completed! Race ID: {race_id}")
 
     st.subheader("💰 Updated Budgets")
-    st.dataframe(get_teams_df(conn), use_container_width=True, hide_index=True)
+    st.dataframe(budgets_df, use_container_width=True, hide_index=True)
@@ -0,0 +1,101 @@
+import math
+import pathlib
+import re
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("sqlparse")
+pytest.importorskip("snowflake.connector")
+
+import pyarrow as pa  # noqa: E402
+import pyarrow.parquet as pq  # noqa: E402
+
+import snowflake_utils  # noqa: E402
+from snowflake_utils import _stage_load_sql  # noqa: E402
+
+
+def _staging_conn(staged):
+    """A mock connection that reads back every file it is asked to PUT.
+
+    The file only exists until bulk_insert_via_stage returns, so it is read
+    while the PUT statement is being "executed".
+    """
+
+    def execute(sql, *args, **kwargs):
+        match = re.match(r"PUT 'file://(.+?)' ", sql)
+        if match:
+            staged["table"] = pq.read_table(match.group(1))
+        elif sql.lstrip().startswith("COPY INTO"):
+            staged["copy_sql"] = sql
+
+    cur = mock.MagicMock()
+    cur.__enter__.return_value = cur
+    cur.execute.side_effect = execute
+    conn = mock.MagicMock()
+    conn.cursor.return_value = cur
+    return conn
+
+
+def _projected_columns(copy_sql):
+    return re.findall(r'\$1:"(\w+)"', copy_sql)
+
+
+def test_stage_load_sql_posix_path_with_spaces():
+    path = pathlib.PurePosixPath("/tmp/my dir/race_results_abc.parquet")
+    put_sql, copy_sql = _stage_load_sql(path, "OPS.RACE_RESULTS", ["RACE_ID", "CAR_ID"])
+
+    assert put_sql == (
+        "PUT 'file:///tmp/my dir/race_results_abc.parquet' @OPS.%RACE_RESULTS "
+        "AUTO_COMPRESS=FALSE OVERWRITE=TRUE"
+    )
+    assert "%20" not in put_sql
+    assert "COPY INTO OPS.RACE_RESULTS (RACE_ID, CAR_ID)" in copy_sql
+    assert 'SELECT $1:"RACE_ID", $1:"CAR_ID" FROM @OPS.%RACE_RESULTS' in copy_sql
+    assert "FILES = ('race_results_abc.parquet')" in copy_sql
+    assert "FILE_FORMAT = (TYPE = PARQUET)" in copy_sql
+
+
+def test_stage_load_sql_windows_path():
+    path = pathlib.PureWindowsPath(r"C:\Temp\tmp x\transactions_abc.parquet")
+    put_sql, copy_sql = _stage_load_sql(path, "OPS.TRANSACTIONS", ["TEAM_ID"])
+
+    assert put_sql.startswith("PUT 'file://C:/Temp/tmp x/transactions_abc.parquet' @OPS.%TRANSACTIONS ")
+    assert "FILES = ('transactions_abc.parquet')" in copy_sql
+
+
+def test_race_results_stage_nulls_and_types(monkeypatch):
+    monkeypatch.setattr(snowflake_utils, "BULK_STAGE_THRESHOLD", 1)
+    staged = {}
+    rows = [
+        (7, 1, 10, 42.5, "FINISHED", 1),
+        (7, 2, 11, None, "DNF", None),
+        (7, 3, 11, math.nan, "DNF", None),
+    ]
+    snowflake_utils.insert_race_results_many(_staging_conn(staged), rows)
+
+    table = staged["table"]
+    assert table.column_names == _projected_columns(staged["copy_sql"])
+    assert table.column_names == ["RACE_ID", "CAR_ID", "TEAM_ID", "FINISH_TIME_MINUTES", "STATUS", "POSITION"]
+    assert table.schema.field("POSITION").type == pa.int64()
+    assert table.column("POSITION").to_pylist() == [1, None, None]
+    assert table.column("FINISH_TIME_MINUTES").to_pylist() == [42.5, None, None]
+    assert table.column("STATUS").to_pylist() == ["FINISHED", "DNF", "DNF"]
+
+
+def test_transactions_stage_nullable_race_id(monkeypatch):
+    monkeypatch.setattr(snowflake_utils, "BULK_STAGE_THRESHOLD", 1)
+    staged = {}
+    rows = [
+        (10, 7, -1000.0, "USD", "Entry fee"),
+        (11, None, 250.0, "USD", "Sponsor"),
+    ]
+    snowflake_utils.record_transactions_bulk(_staging_conn(staged), rows)
+
+    table = staged["table"]
+    assert table.column_names == _projected_columns(staged["copy_sql"])
+    assert table.column_names == ["TEAM_ID", "RACE_ID", "AMOUNT", "CURRENCY", "REASON"]
+    assert table.schema.field("RACE_ID").type == pa.int64()
+    assert table.column("RACE_ID").to_pylist() == [7, None]